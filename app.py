@@ -4,7 +4,7 @@
 # Objetivo: API FastAPI do micro-serviço svc-kg (graph + visualizações + ops)
 # Funções/métodos:
 # - live/health/ready/ops_status: sondas e status operacional
-# - graph_membros: retorna grafo (nós/arestas) via Supabase RPC (fallback com e sem p_)
+# - graph_membros: retorna grafo (nós/arestas) via Supabase RPC (p_* primeiro; fallback sem p_)
 # - vis_visjs: página HTML com vis-network (sem f-string ao redor do JS; arestas ultrafinas; busca; cores CV/PCC/funções; física OFF após estabilizar)
 # - vis_pyvis: página HTML com PyVis (arestas ultrafinas; física OFF após estabilizar; busca)
 # - /docs: Swagger UI custom usando /openapi.json do FastAPI
@@ -14,21 +14,52 @@
 
 import os
 import json
+import asyncio
+import gzip
+import hashlib
+import importlib.util
 import logging
+import math
+import re
 import socket
-from typing import Any, Dict, List, Optional
+import sys
+import time
+import zlib
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
 
 import httpx
-from fastapi import FastAPI, Query, Response, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
+import orjson
+from cachetools import TLRUCache, TTLCache
+from fastapi import Body, FastAPI, Query, Request, Response, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import (
+    HTMLResponse,
+    ORJSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, Field
 
 try:
     from redis import asyncio as aioredis  # redis 5.x
 except Exception:  # pragma: no cover
     aioredis = None
 
+# h2 instalado habilita http2=True no httpx (só se verifica a presença).
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+try:
+    import rcssmin
+    import rjsmin
+except Exception:  # pragma: no cover
+    rcssmin = rjsmin = None
+
 # -----------------------------------------------------------------------------
 # Config
 # -----------------------------------------------------------------------------
@@ -43,11 +74,28 @@ SUPABASE_SERVICE_KEY = (
 )
 SUPABASE_RPC_FN = os.getenv("SUPABASE_RPC_FN", "get_graph_membros")
 SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "15"))
+# Conexão TCP/TLS falha rápido; o restante do orçamento fica para a RPC em si.
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "100"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "20"))
 
 ENABLE_REDIS_CACHE = os.getenv("ENABLE_REDIS_CACHE", "false").lower() == "true"
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 CACHE_API_TTL = int(os.getenv("CACHE_API_TTL", "60"))
+# Erros 4xx do RPC ficam em cache por poucos segundos (0 desliga).
+CACHE_NEGATIVE_TTL = int(os.getenv("CACHE_NEGATIVE_TTL", "5"))
 CACHE_STATIC_MAX_AGE = int(os.getenv("CACHE_STATIC_MAX_AGE", "86400"))
+# Só habilite em implantações sem autenticação: com "true" proxies compartilhados
+# (Traefik) também guardam as respostas do grafo.
+CACHE_HTTP_PUBLIC = os.getenv("CACHE_HTTP_PUBLIC", "false").lower() == "true"
+# Limite de entradas dos caches em memória (por worker): grafos/recortes e
+# páginas HTML prontas (maiores, por isso um limite à parte).
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+CACHE_MAX_PAGES = int(os.getenv("CACHE_MAX_PAGES", "64"))
+
+HEALTH_INTERVAL = int(os.getenv("HEALTH_INTERVAL", "10"))
+# Máximo de recortes por chamada a POST /v1/graph/batch.
+GRAPH_BATCH_MAX_ITEMS = int(os.getenv("GRAPH_BATCH_MAX_ITEMS", "20"))
 
 # -----------------------------------------------------------------------------
 # App / Logger / CORS
@@ -62,6 +110,8 @@ app = FastAPI(
     docs_url=None,
     redoc_url=None,
     openapi_url="/openapi.json",
+    # Respostas JSON (sondas, erros de rota) serializadas com orjson.
+    default_response_class=ORJSONResponse,
 )
 
 os.makedirs("static", exist_ok=True)
@@ -87,6 +137,15 @@ app.add_middleware(
             ","
         )
     ],
+    # Navegador reaproveita o preflight (OPTIONS) por este tempo, em segundos.
+    max_age=int(os.getenv("CORS_MAX_AGE", "86400")),
+)
+# Comprime o que ainda sai cru (cache=false em streaming, openapi, /v1/vis/pyvis
+# sem cache). Respostas já pré-comprimidas (Content-Encoding) passam direto.
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")),
+    compresslevel=6,
 )
 
 # -----------------------------------------------------------------------------
@@ -96,6 +155,117 @@ _http: Optional[httpx.AsyncClient] = None
 _redis = None  # type: ignore
 
 
+def _entry_deadline(_key: Any, entry: Tuple[Any, float], _now: float) -> float:
+    # Entradas (valor, expira_em) com prazo absoluto em time.monotonic().
+    return entry[1]
+
+
+def _cache_get(cache: TLRUCache, key: Any) -> Any:
+    entry = cache.get(key)
+    return None if entry is None else entry[0]
+
+
+# Os caches do grafo e os derivados dele (recortes, páginas) guardam o prazo
+# do dado de origem, não um TTL novo por camada: um recorte ou página montado
+# de um grafo prestes a expirar expira junto com ele, e o grafo aquecido a
+# partir do Redis herda o TTL restante da chave (PTTL).
+#
+# Cache em memória (por worker) na frente do Redis: evita o round-trip e o
+# orjson.loads para as chaves mais quentes. Os valores são compartilhados entre
+# requisições — quem consome não deve mutá-los.
+_local_cache: TLRUCache = TLRUCache(maxsize=CACHE_MAX_ENTRIES, ttu=_entry_deadline)
+# Erros 4xx do RPC por (faccao_id, include_co, max_pairs): (mensagem, status).
+_negative_cache: TTLCache = TTLCache(
+    maxsize=CACHE_MAX_ENTRIES, ttl=max(CACHE_NEGATIVE_TTL, 1)
+)
+# Corpo JSON do recorte (após truncate_preview) e sua ETag, prontos para a resposta.
+_preview_cache: TLRUCache = TLRUCache(maxsize=CACHE_MAX_ENTRIES, ttu=_entry_deadline)
+# Página vis.js final (source=server; bytes crus, gzip e ETag) por combinação de
+# parâmetros: o hit não faz nem o join do shell com o JSON embutido.
+_visjs_cache: TLRUCache = TLRUCache(maxsize=CACHE_MAX_PAGES, ttu=_entry_deadline)
+
+
+# Escape de texto livre (title) interpolado no HTML: uma passada em C.
+_HTML_ESCAPE = str.maketrans(
+    {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#x27;"}
+)
+
+
+def _accepts_gzip(request: Request) -> bool:
+    return "gzip" in request.headers.get("accept-encoding", "").lower()
+
+
+def _precompressed(
+    request: Request,
+    raw: bytes,
+    gz: bytes,
+    headers: Optional[Dict[str, str]] = None,
+    media_type: str = "text/html",
+) -> Response:
+    # Entrega o corpo já comprimido (gzip) quando o cliente aceita; Vary sempre,
+    # para que caches intermediários não misturem as duas variantes. Com
+    # Content-Encoding definido o GZipMiddleware não recomprime.
+    h = dict(headers or {})
+    h["Vary"] = "Accept-Encoding"
+    if _accepts_gzip(request):
+        h["Content-Encoding"] = "gzip"
+        return Response(gz, status_code=200, headers=h, media_type=media_type)
+    return Response(raw, status_code=200, headers=h, media_type=media_type)
+
+
+# Páginas dos visualizadores e JSON do grafo: o navegador revalida com
+# If-None-Match e recebe 304 sem corpo enquanto o conteúdo não muda. Por padrão
+# "private" (a requisição pode levar Authorization); com CACHE_HTTP_PUBLIC o
+# proxy também guarda o corpo, pelo TTL do cache da API.
+_REVALIDATE_CACHE_CONTROL = (
+    f"public, max-age={CACHE_API_TTL}, must-revalidate"
+    if CACHE_HTTP_PUBLIC
+    else "private, max-age=30, must-revalidate"
+)
+# Casca sem dados (source=client): só muda com o deploy, cache longo.
+_STATIC_CACHE_CONTROL = f"public, max-age={CACHE_STATIC_MAX_AGE}"
+
+
+def _weak_etag(raw: bytes) -> str:
+    return 'W/"' + hashlib.blake2s(raw, digest_size=8).hexdigest() + '"'
+
+
+def _pack_body(raw: bytes) -> Tuple[bytes, bytes, str]:
+    # Corpo cru, gzip e ETag fraca, calculados uma vez por entrada de cache.
+    return raw, gzip.compress(raw, compresslevel=6), _weak_etag(raw)
+
+
+def _cached_body(
+    request: Request,
+    page: Tuple[bytes, bytes, str],
+    headers: Optional[Dict[str, str]] = None,
+    media_type: str = "text/html",
+    cache_control: str = _REVALIDATE_CACHE_CONTROL,
+) -> Response:
+    raw, gz, etag = page
+    cache_headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+    }
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=cache_headers)
+    return _precompressed(
+        request, raw, gz, {**(headers or {}), **cache_headers}, media_type
+    )
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    # If-None-Match com comparação fraca (RFC 9110): ignora o prefixo W/.
+    inm = request.headers.get("if-none-match")
+    if not inm:
+        return False
+    if inm.strip() == "*":
+        return True
+    tag = etag.removeprefix("W/")
+    return any(t.strip().removeprefix("W/") == tag for t in inm.split(","))
+
+
 def _env_backend_ok() -> bool:
     return bool(SUPABASE_URL and SUPABASE_SERVICE_KEY and SUPABASE_RPC_FN)
 
@@ -103,7 +273,20 @@ def _env_backend_ok() -> bool:
 async def _get_http() -> httpx.AsyncClient:
     global _http
     if _http is None:
-        _http = httpx.AsyncClient(timeout=SUPABASE_TIMEOUT)
+        # HTTP/2 (quando o h2 está instalado): requisições concorrentes ao
+        # Supabase multiplexadas numa mesma conexão.
+        _http = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                SUPABASE_TIMEOUT,
+                connect=min(SUPABASE_CONNECT_TIMEOUT, SUPABASE_TIMEOUT),
+            ),
+            http2=_HTTP2,
+            limits=httpx.Limits(
+                max_connections=SUPABASE_MAX_CONNECTIONS,
+                max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+                keepalive_expiry=30.0,
+            ),
+        )
     return _http
 
 
@@ -112,7 +295,12 @@ async def _get_redis():
     if not ENABLE_REDIS_CACHE or aioredis is None:
         return None
     if _redis is None:
-        _redis = aioredis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
+        # Sem decode_responses: os valores são bytes do orjson, lidos direto.
+        # Keepalive + health check: conexões ociosas do pool derrubadas por
+        # NAT/proxy são detectadas antes de um GET do caminho quente falhar.
+        _redis = aioredis.from_url(
+            REDIS_URL, socket_keepalive=True, health_check_interval=30
+        )
     return _redis
 
 
@@ -151,84 +339,131 @@ def platform_info() -> Dict[str, Any]:
 # Utils: normalização e truncamento
 # -----------------------------------------------------------------------------
 def _normalize_pg_text_array_label(s: str) -> str:
-    if not s:
+    # Caso comum (rótulo simples): uma busca em C, sem strip/alocação.
+    if not s or "{" not in s:
         return s
     s2 = s.strip()
     if len(s2) >= 2 and s2[0] == "{" and s2[-1] == "}":
         inner = s2[1:-1]
         if not inner:
             return ""
-        parts = [p.strip().strip('"') for p in inner.split(",")]
-        parts = [p for p in parts if p and p.lower() != "null"]
-        return ", ".join(parts)
+        return ", ".join(
+            p
+            for p in (q.strip().strip('"') for q in inner.split(","))
+            if p and p.lower() != "null"
+        )
     return s
 
 
 def normalize_graph_labels(data: Dict[str, Any]) -> Dict[str, Any]:
+    # Muta os dicts de nó/aresta no lugar (sem cópia): a entrada é sempre um
+    # payload recém-decodificado do RPC, que não é reutilizado por ninguém.
     nodes = data.get("nodes", []) or []
     edges = data.get("edges", []) or []
 
-    fixed_nodes: List[Dict[str, Any]] = []
-    node_ids: set = set()
+    # Aliases locais: evitam LOAD_GLOBAL/LOAD_ATTR a cada iteração.
+    _str = str
+    _isinstance = isinstance
+    _intern = sys.intern
+    _clean = _normalize_pg_text_array_label
+
+    # Um único dict id -> nó: deduplica (vale a primeira ocorrência, como nos
+    # renderizadores), preserva a ordem e serve de conjunto de ids das arestas.
+    # Ids internados: o mesmo id é o mesmo objeto entre payloads em cache.
+    by_id: Dict[str, Dict[str, Any]] = {}
+    get_node = by_id.get
     for n in nodes:
         if not n or "id" not in n:
             continue
-        nid = str(n["id"])
-        node_ids.add(nid)
+        nid = n["id"]
+        if type(nid) is not str:
+            nid = _str(nid)
+        nid = _intern(nid)
+        if nid in by_id:
+            continue
+        n["id"] = nid
         label = n.get("label")
-        if isinstance(label, str):
-            label = _normalize_pg_text_array_label(label)
-        fixed = dict(n)
-        fixed["id"] = nid
-        if label is not None:
-            fixed["label"] = label
-        fixed_nodes.append(fixed)
+        if _isinstance(label, str):
+            n["label"] = _clean(label)
+        by_id[nid] = n
 
     fixed_edges: List[Dict[str, Any]] = []
+    add_edge = fixed_edges.append
     for e in edges:
         if not e:
             continue
-        a = str(e.get("source"))
-        b = str(e.get("target"))
-        if a in node_ids and b in node_ids:
-            fe = dict(e)
-            fe["source"] = a
-            fe["target"] = b
-            fixed_edges.append(fe)
-
-    return {"nodes": fixed_nodes, "edges": fixed_edges}
+        a = e.get("source")
+        b = e.get("target")
+        if type(a) is not str:
+            a = _str(a)
+        if type(b) is not str:
+            b = _str(b)
+        na = get_node(a)
+        nb = get_node(b)
+        if na is not None and nb is not None:
+            # Reaproveita o objeto str do id do nó: as buscas seguintes
+            # (truncate_preview, índices dos renderizadores) acertam por
+            # identidade, sem comparar caracteres.
+            e["source"] = na["id"]
+            e["target"] = nb["id"]
+            add_edge(e)
+
+    return {"nodes": list(by_id.values()), "edges": fixed_edges}
 
 
 def truncate_preview(
     data: Dict[str, Any], max_nodes: int, max_edges: int
 ) -> Dict[str, Any]:
-    ns = data.get("nodes", [])[: max(0, max_nodes)]
-    idset = {str(n["id"]) for n in ns if n and "id" in n}
-    es = [
-        e
-        for e in (data.get("edges", []) or [])
-        if e and str(e.get("source")) in idset and str(e.get("target")) in idset
-    ]
-    es = es[: max(0, max_edges)]
+    # Entrada sempre vem de normalize_graph_labels: nós não nulos com id str e
+    # arestas com source/target str — sem coerções nem guardas por item.
+    nodes = data.get("nodes", [])
+    edges = data.get("edges", []) or []
+    # Caso comum: o grafo já cabe nos limites. Como toda aresta normalizada
+    # aponta para nós existentes, não há o que filtrar.
+    if len(nodes) <= max_nodes:
+        if len(edges) <= max_edges:
+            return data
+        return {"nodes": nodes, "edges": edges[: max(0, max_edges)]}
+    ns = nodes[: max(0, max_nodes)]
+    idset = {n["id"] for n in ns}
+    # islice para a varredura assim que max_edges arestas válidas são achadas.
+    es = list(
+        islice(
+            (e for e in edges if e["source"] in idset and e["target"] in idset),
+            max(0, max_edges),
+        )
+    )
     return {"nodes": ns, "edges": es}
 
 
 # -----------------------------------------------------------------------------
 # Backend (Supabase RPC) com fallback
 # -----------------------------------------------------------------------------
+# URL e headers do RPC são fixos por processo: montados uma única vez.
+# O httpx já anuncia gzip (e br, com o pacote brotli instalado) em Accept-Encoding.
+_RPC_URL = f"{SUPABASE_URL.rstrip('/')}/rest/v1/rpc/{SUPABASE_RPC_FN}"
+_RPC_HEADERS = {
+    "apikey": SUPABASE_SERVICE_KEY,
+    "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
+    "Content-Type": "application/json",
+    "Accept": "application/json",
+}
+
+
+class SupabaseRPCError(RuntimeError):
+    # Resposta HTTP != 200 do PostgREST; status_code separa erro de entrada
+    # (4xx, cacheável por pouco tempo) de falha do backend.
+    def __init__(self, message: str, status_code: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
 async def _rpc_call(payload: Dict[str, Any]) -> Dict[str, Any]:
-    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/rpc/{SUPABASE_RPC_FN}"
-    headers = {
-        "apikey": SUPABASE_SERVICE_KEY,
-        "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-    }
     client = await _get_http()
-    resp = await client.post(url, json=payload, headers=headers)
+    resp = await client.post(_RPC_URL, json=payload, headers=_RPC_HEADERS)
     if resp.status_code != 200:
-        raise RuntimeError(f"{resp.status_code}: {resp.text}")
-    return resp.json()
+        raise SupabaseRPCError(f"{resp.status_code}: {resp.text}", resp.status_code)
+    return orjson.loads(resp.content)
 
 
 async def supabase_rpc_get_graph(
@@ -238,15 +473,9 @@ async def supabase_rpc_get_graph(
         raise RuntimeError(
             "backend_not_configured: defina SUPABASE_URL/SUPABASE_SERVICE_KEY"
         )
+    # A assinatura atual do RPC (db/00_init.sql) usa parâmetros p_*: vai direto
+    # nela e só repete sem prefixo quando o PostgREST não acha a função.
     try:
-        data = await _rpc_call(
-            {"faccao_id": faccao_id, "include_co": include_co, "max_pairs": max_pairs}
-        )
-    except Exception as e1:
-        msg = str(e1)
-        # Fallback para versões do RPC que usam parâmetros prefixados com p_
-        if "PGRST202" not in msg and "404" not in msg:
-            raise RuntimeError(f"Supabase RPC {SUPABASE_RPC_FN} falhou: {msg}")
         data = await _rpc_call(
             {
                 "p_faccao_id": faccao_id,
@@ -254,6 +483,17 @@ async def supabase_rpc_get_graph(
                 "p_max_pairs": max_pairs,
             }
         )
+    except Exception as e1:
+        msg = str(e1)
+        # Fallback para versões antigas do RPC, sem o prefixo p_
+        if "PGRST202" not in msg and "404" not in msg:
+            raise SupabaseRPCError(
+                f"Supabase RPC {SUPABASE_RPC_FN} falhou: {msg}",
+                getattr(e1, "status_code", None),
+            )
+        data = await _rpc_call(
+            {"faccao_id": faccao_id, "include_co": include_co, "max_pairs": max_pairs}
+        )
 
     if not isinstance(data, dict):
         if (
@@ -270,30 +510,192 @@ async def supabase_rpc_get_graph(
     return data
 
 
+# RPCs em andamento por (faccao_id, include_co, max_pairs).
+_inflight: Dict[Tuple[Any, ...], "asyncio.Task[Dict[str, Any]]"] = {}
+
+
+def _inflight_done(key: Tuple[Any, ...], task: "asyncio.Task[Dict[str, Any]]") -> None:
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception()  # marca como consumida se todos os clientes saíram
+
+
+async def _fetch_graph_normalized(
+    faccao_id: Optional[int], include_co: bool, max_pairs: int
+) -> Dict[str, Any]:
+    raw = await supabase_rpc_get_graph(faccao_id, include_co, max_pairs)
+    # Limpeza/dedup é CPU pura sobre o payload inteiro: fora do event loop.
+    return await run_in_threadpool(normalize_graph_labels, raw)
+
+
+def _redis_pack(raw: bytes) -> bytes:
+    # zlib nível 1: JSON de grafo comprime várias vezes, custo de CPU mínimo.
+    return zlib.compress(raw, 1)
+
+
+def _redis_unpack(value: bytes) -> bytes:
+    # Entradas antigas (JSON puro, começam com "{") continuam legíveis; um
+    # stream zlib sempre começa com 0x78.
+    if value[:1] == b"\x78":
+        return zlib.decompress(value)
+    return value
+
+
+def _graph_redis_key(faccao_id: Optional[int], include_co: bool, max_pairs: int) -> str:
+    return f"kg:graph:{faccao_id}:{include_co}:{max_pairs}"
+
+
 async def fetch_graph_sanitized(
     faccao_id: Optional[int], include_co: bool, max_pairs: int, use_cache: bool = True
-) -> Dict[str, Any]:
-    cache_key = f"kg:graph:{faccao_id}:{include_co}:{max_pairs}"
+) -> Tuple[Dict[str, Any], float]:
+    # Devolve o grafo e o prazo (time.monotonic) até o qual ele pode ser
+    # servido; caches derivados usam esse prazo em vez de um TTL próprio.
+    # Chave local em tupla (sem formatar string no caminho quente); a do Redis
+    # só é montada quando o cache local falha.
+    local_key = (faccao_id, include_co, max_pairs)
     if use_cache:
+        entry = _local_cache.get(local_key)
+        if entry is not None:
+            return entry
+        neg = _negative_cache.get(local_key)
+        if neg is not None:
+            raise SupabaseRPCError(*neg)
         r = await _get_redis()
         if r:
-            cached = await r.get(cache_key)
+            redis_key = _graph_redis_key(*local_key)
+            pipe = r.pipeline(transaction=False)
+            pipe.get(redis_key)
+            pipe.pttl(redis_key)
+            cached, pttl = await pipe.execute()
             if cached:
                 try:
-                    return json.loads(cached)
+                    hit = orjson.loads(_redis_unpack(cached))
+                    # TTL restante da chave (sem prazo: -1 -> TTL cheio).
+                    ttl = pttl / 1000 if pttl and pttl > 0 else CACHE_API_TTL
+                    entry = (hit, time.monotonic() + min(ttl, CACHE_API_TTL))
+                    _local_cache[local_key] = entry
+                    return entry
                 except Exception:
                     pass
 
-    raw = await supabase_rpc_get_graph(faccao_id, include_co, max_pairs)
-    fixed = normalize_graph_labels(raw)
-
+    # Single-flight: chamadas concorrentes com os mesmos parâmetros aguardam o
+    # mesmo RPC. A task é independente de quem a criou (shield), então o
+    # cancelamento de um cliente não derruba os demais.
+    task = _inflight.get(local_key)
+    if task is None:
+        task = asyncio.ensure_future(
+            _fetch_graph_normalized(faccao_id, include_co, max_pairs)
+        )
+        _inflight[local_key] = task
+        task.add_done_callback(lambda t: _inflight_done(local_key, t))
+    try:
+        fixed = await asyncio.shield(task)
+    except SupabaseRPCError as e:
+        # 4xx (parâmetro inválido etc.) não muda em segundos: evita repetir a
+        # RPC a cada requisição do mesmo cliente.
+        status = e.status_code
+        if use_cache and CACHE_NEGATIVE_TTL > 0 and status and 400 <= status < 500:
+            _negative_cache[local_key] = (str(e), status)
+        raise
+
+    entry = (fixed, time.monotonic() + CACHE_API_TTL)
     if use_cache:
+        _local_cache[local_key] = entry
         r = await _get_redis()
         if r:
             await r.set(
-                cache_key, json.dumps(fixed, ensure_ascii=False), ex=CACHE_API_TTL
+                _graph_redis_key(*local_key),
+                _redis_pack(orjson.dumps(fixed)),
+                ex=CACHE_API_TTL,
             )
-    return fixed
+    return entry
+
+
+async def fetch_graph_preview_body(
+    faccao_id: Optional[int],
+    include_co: bool,
+    max_pairs: int,
+    max_nodes: int,
+    max_edges: int,
+    use_cache: bool = True,
+) -> Tuple[bytes, float]:
+    # Recorte serializado (orjson), sem gzip nem ETag, e o prazo do grafo.
+    data, expires_at = await fetch_graph_sanitized(
+        faccao_id, include_co, max_pairs, use_cache=use_cache
+    )
+    return orjson.dumps(truncate_preview(data, max_nodes, max_edges)), expires_at
+
+
+async def fetch_graph_preview_json(
+    faccao_id: Optional[int],
+    include_co: bool,
+    max_pairs: int,
+    max_nodes: int,
+    max_edges: int,
+) -> Tuple[bytes, bytes, str]:
+    # Recorte já serializado por combinação de parâmetros, com gzip e ETag:
+    # um hit não refaz truncate_preview, o dumps, a compressão nem o hash.
+    key = (faccao_id, include_co, max_pairs, max_nodes, max_edges)
+    hit = _cache_get(_preview_cache, key)
+    if hit is not None:
+        return hit
+    body, expires_at = await fetch_graph_preview_body(
+        faccao_id, include_co, max_pairs, max_nodes, max_edges
+    )
+    hit = await run_in_threadpool(_pack_body, body)
+    _preview_cache[key] = (hit, expires_at)
+    return hit
+
+
+# -----------------------------------------------------------------------------
+# Health (poller em background)
+# -----------------------------------------------------------------------------
+# As sondas (/health, /ready, /ops/status) leem este snapshot em vez de pingar
+# Redis/Supabase a cada chamada: a cadência do orquestrador não chega ao backend.
+_health_state: Dict[str, Any] = {"checked_at": None}
+_health_task: Optional[asyncio.Task] = None
+
+
+async def _probe_health() -> None:
+    global _health_state
+    state: Dict[str, Any] = {"redis": False, "redis_ok": True, "backend_ok": False}
+
+    async def probe_redis() -> None:
+        r = await _get_redis()
+        if r:
+            try:
+                state["redis"] = bool(
+                    await asyncio.wait_for(r.ping(), timeout=HEALTH_INTERVAL)
+                )
+            except Exception as e:
+                state["redis_ok"] = False
+                state["redis_error"] = str(e) or type(e).__name__
+
+    async def probe_backend() -> None:
+        if _env_backend_ok():
+            try:
+                await asyncio.wait_for(
+                    supabase_rpc_get_graph(None, False, 1), timeout=HEALTH_INTERVAL
+                )
+                state["backend_ok"] = True
+            except Exception as e:
+                state["backend_error"] = str(e) or type(e).__name__
+
+    # Sondas em paralelo, cada uma limitada a HEALTH_INTERVAL: o ciclo dura o
+    # tempo da mais lenta (não a soma) e nunca atropela o próximo.
+    await asyncio.gather(probe_redis(), probe_backend())
+    state["checked_at"] = datetime.now(timezone.utc).isoformat()
+    _health_state = state
+
+
+async def _health_poller() -> None:
+    while True:
+        try:
+            await _probe_health()
+        except Exception:  # pragma: no cover
+            log.exception("falha no poller de health")
+        await asyncio.sleep(HEALTH_INTERVAL)
 
 
 # -----------------------------------------------------------------------------
@@ -301,19 +703,25 @@ async def fetch_graph_sanitized(
 # -----------------------------------------------------------------------------
 @app.on_event("startup")
 async def _startup():
+    global _health_task
     await _get_http()
     if ENABLE_REDIS_CACHE and aioredis:
         await _get_redis()
+    _health_task = asyncio.create_task(_health_poller())
     log.info(
-        "svc-kg iniciado (backend: %s, cache: %s)",
+        "svc-kg iniciado (backend: %s, cache: %s, loop: %s)",
         "supabase" if _env_backend_ok() else "none",
         "redis" if ENABLE_REDIS_CACHE else "none",
+        type(asyncio.get_running_loop()).__module__,
     )
 
 
 @app.on_event("shutdown")
 async def _shutdown():
-    global _http, _redis
+    global _http, _redis, _health_task
+    if _health_task:
+        _health_task.cancel()
+        _health_task = None
     if _http:
         await _http.aclose()
         _http = None
@@ -330,31 +738,26 @@ async def live():
     return PlainTextResponse("ok", status_code=200)
 
 
-@app.get("/health", response_class=JSONResponse, tags=["ops"])
+@app.get("/health", response_class=ORJSONResponse, tags=["ops"])
 async def health(deep: bool = Query(default=False)):
+    hs = _health_state
     out = platform_info()
     out.update(
         {
             "status": "ok",
-            "redis": False,
+            "redis": hs.get("redis", False),
             "backend": "supabase" if _env_backend_ok() else "none",
+            "checked_at": hs["checked_at"],
         }
     )
-    r_ok = True
-    r = await _get_redis()
-    if r:
-        try:
-            out["redis"] = bool(await r.ping())
-        except Exception as e:
-            r_ok = False
-            out["redis_error"] = str(e)
+    r_ok = hs.get("redis_ok", True)
+    if "redis_error" in hs:
+        out["redis_error"] = hs["redis_error"]
     b_ok = _env_backend_ok()
     if deep and b_ok:
-        try:
-            _ = await supabase_rpc_get_graph(None, False, 1)
-        except Exception as e:
-            b_ok = False
-            out["backend_error"] = str(e)
+        b_ok = bool(hs.get("backend_ok"))
+        if "backend_error" in hs:
+            out["backend_error"] = hs["backend_error"]
     out["ok"] = (not ENABLE_REDIS_CACHE or r_ok) and b_ok
     out["supabase"] = {
         "url": SUPABASE_URL,
@@ -362,44 +765,35 @@ async def health(deep: bool = Query(default=False)):
         "timeout": SUPABASE_TIMEOUT,
         "service_key_tail": redact(SUPABASE_SERVICE_KEY),
     }
-    return JSONResponse(out, status_code=200 if out["ok"] else 503)
+    return ORJSONResponse(out, status_code=200 if out["ok"] else 503)
 
 
-@app.get("/ready", response_class=JSONResponse, tags=["ops"])
+@app.get("/ready", response_class=ORJSONResponse, tags=["ops"])
 async def ready():
-    r_ok = True
+    hs = _health_state
     out = platform_info()
-    r = await _get_redis()
-    if r:
-        try:
-            out["redis"] = bool(await r.ping())
-        except Exception as e:
-            r_ok = False
-            out["redis_error"] = str(e)
-
-    b_ok = False
-    if _env_backend_ok():
-        try:
-            _ = await supabase_rpc_get_graph(None, False, 1)
-            b_ok = True
-        except Exception as e:
-            out["backend_error"] = str(e)
-
+    out["checked_at"] = hs["checked_at"]
+    if "redis" in hs:
+        out["redis"] = hs["redis"]
+    for k in ("redis_error", "backend_error"):
+        if k in hs:
+            out[k] = hs[k]
+    r_ok = hs.get("redis_ok", True)
+    b_ok = bool(hs.get("backend_ok"))
     out["ok"] = (not ENABLE_REDIS_CACHE or r_ok) and b_ok
-    return JSONResponse(out, status_code=200 if out["ok"] else 503)
+    return ORJSONResponse(out, status_code=200 if out["ok"] else 503)
 
 
-@app.get("/ops/status", response_class=JSONResponse, tags=["ops"])
+@app.get("/ops/status", response_class=ORJSONResponse, tags=["ops"])
 async def ops_status():
     info = platform_info()
+    hs = _health_state
     redis_cfg = {"enabled": ENABLE_REDIS_CACHE, "url": REDIS_URL}
     if ENABLE_REDIS_CACHE and aioredis:
-        try:
-            r = await _get_redis()
-            if r:
-                redis_cfg["ping"] = bool(await r.ping())
-        except Exception as e:
-            redis_cfg["error"] = str(e)
+        if "redis_error" in hs:
+            redis_cfg["error"] = hs["redis_error"]
+        elif hs["checked_at"]:
+            redis_cfg["ping"] = hs["redis"]
     supa = {
         "configured": _env_backend_ok(),
         "url": SUPABASE_URL,
@@ -407,15 +801,16 @@ async def ops_status():
         "timeout": SUPABASE_TIMEOUT,
         "service_key_tail": redact(SUPABASE_SERVICE_KEY),
     }
-    info.update({"redis": redis_cfg, "supabase": supa})
-    return JSONResponse(info, status_code=200)
+    info.update({"redis": redis_cfg, "supabase": supa, "checked_at": hs["checked_at"]})
+    return ORJSONResponse(info, status_code=200)
 
 
 # -----------------------------------------------------------------------------
 # API de dados do grafo
 # -----------------------------------------------------------------------------
-@app.get("/v1/graph/membros", response_class=JSONResponse, tags=["graph"])
+@app.get("/v1/graph/membros", response_class=ORJSONResponse, tags=["graph"])
 async def graph_membros(
+    request: Request,
     faccao_id: Optional[int] = Query(default=None),
     include_co: bool = Query(default=True),
     max_pairs: int = Query(default=8000, ge=1, le=200000),
@@ -424,62 +819,84 @@ async def graph_membros(
     cache: bool = Query(default=True),
 ):
     try:
-        data = await fetch_graph_sanitized(
-            faccao_id, include_co, max_pairs, use_cache=cache
+        if not cache:
+            # Dado fresco pedido explicitamente: sem ETag e sem guardar em
+            # navegador/proxy (o GZipMiddleware ainda comprime o corpo).
+            body, _ = await fetch_graph_preview_body(
+                faccao_id, include_co, max_pairs, max_nodes, max_edges, False
+            )
+            return Response(
+                body,
+                status_code=200,
+                media_type="application/json",
+                headers={"Cache-Control": "no-store"},
+            )
+        page = await fetch_graph_preview_json(
+            faccao_id, include_co, max_pairs, max_nodes, max_edges
         )
-        data = truncate_preview(data, max_nodes, max_edges)
-        return JSONResponse(data, status_code=200)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"graph_fetch_error: {e}")
+    return _cached_body(request, page, media_type="application/json")
 
 
-# -----------------------------------------------------------------------------
-# VIS.JS (vis-network) — sem f-string ao redor do JS para evitar problemas com chaves
-# -----------------------------------------------------------------------------
-@app.get("/v1/vis/visjs", response_class=HTMLResponse, tags=["viz"])
-async def vis_visjs(
-    response: Response,
-    faccao_id: Optional[int] = Query(default=None),
-    include_co: bool = Query(default=True),
-    max_pairs: int = Query(default=8000),
-    max_nodes: int = Query(default=2000),
-    max_edges: int = Query(default=4000),
+class GraphBatchItem(BaseModel):
+    # Mesmos parâmetros (e limites) de GET /v1/graph/membros.
+    faccao_id: Optional[int] = None
+    include_co: bool = True
+    max_pairs: int = Field(default=8000, ge=1, le=200000)
+    max_nodes: int = Field(default=2000, ge=50, le=20000)
+    max_edges: int = Field(default=4000, ge=50, le=200000)
+
+
+@app.post("/v1/graph/batch", response_class=ORJSONResponse, tags=["graph"])
+async def graph_batch(
+    items: List[GraphBatchItem] = Body(...),
     cache: bool = Query(default=True),
-    theme: str = Query(default="light"),
-    title: str = Query(default="Knowledge Graph (vis.js)"),
-    debug: bool = Query(default=False),
-    source: str = Query(default="server", pattern="^(server|client)$"),
 ):
-    embedded_block = ""
-    if source == "server":
-        try:
-            data = await fetch_graph_sanitized(
-                faccao_id, include_co, max_pairs, use_cache=cache
-            )
-            data = truncate_preview(data, max_nodes, max_edges)
-            data = normalize_graph_labels(data)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"graph_fetch_error: {e}")
-        embedded_block = (
-            '<script id="__KG_DATA__" type="application/json">'
-            + json.dumps(data, ensure_ascii=False)
-            + "</script>"
+    # Vários recortes numa chamada: os RPCs ao Supabase (independentes) correm
+    # em paralelo no mesmo cliente httpx, limitados pelo pool de conexões;
+    # itens repetidos caem no single-flight/cache de fetch_graph_sanitized.
+    if len(items) > GRAPH_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"batch_too_large: máximo de {GRAPH_BATCH_MAX_ITEMS} itens",
         )
 
-    js_href = (
-        "/static/vendor/vis-network.min.js"
-        if os.path.exists("static/vendor/vis-network.min.js")
-        else "https://unpkg.com/vis-network@9.1.6/dist/vis-network.min.js"
-    )
-    css_href = (
-        "/static/vendor/vis-network.min.css"
-        if os.path.exists("static/vendor/vis-network.min.css")
-        else "https://unpkg.com/vis-network@9.1.6/styles/vis-network.min.css"
-    )
-    bg = "#0b0f19" if theme == "dark" else "#ffffff"
+    async def one(it: GraphBatchItem) -> bytes:
+        args = (it.faccao_id, it.include_co, it.max_pairs, it.max_nodes, it.max_edges)
+        if cache:
+            return (await fetch_graph_preview_json(*args))[0]
+        return (await fetch_graph_preview_body(*args, False))[0]
+
+    try:
+        bodies = await asyncio.gather(*(one(it) for it in items))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"graph_fetch_error: {e}")
+    # Cada recorte já está serializado: o array é só a junção dos bytes, na
+    # ordem dos itens (o GZipMiddleware comprime a resposta).
+    body = b"[" + b",".join(bodies) + b"]"
+    return Response(body, status_code=200, media_type="application/json")
 
-    # ---- JavaScript embutido (NÃO É f-string) ----
-    script_js = """
+
+# -----------------------------------------------------------------------------
+# VIS.JS (vis-network) — sem f-string ao redor do JS para evitar problemas com chaves
+# -----------------------------------------------------------------------------
+# O template é montado uma única vez no import: o JS embutido (~6 kB), os
+# estilos e os hrefs do vis-network são invariantes. Por requisição só se
+# preenchem os marcadores %%NOME%% (título, tema, fonte, dados embutidos).
+_VIS_JS_HREF = (
+    "/static/vendor/vis-network.min.js"
+    if os.path.exists("static/vendor/vis-network.min.js")
+    else "https://unpkg.com/vis-network@9.1.6/dist/vis-network.min.js"
+)
+_VIS_CSS_HREF = (
+    "/static/vendor/vis-network.min.css"
+    if os.path.exists("static/vendor/vis-network.min.css")
+    else "https://unpkg.com/vis-network@9.1.6/styles/vis-network.min.css"
+)
+
+# ---- JavaScript embutido (NÃO É f-string) ----
+_VISJS_SCRIPT = """
 <script>
 (function(){
   const container = document.getElementById('mynetwork');
@@ -498,6 +915,7 @@ async def vis_visjs(
     'CO_FACCAO':        '#aa9424',
     'CO_FUNCAO':        '#546e7a'
   };
+  const FUN_RELS = new Set(['EXERCE', 'FUNCAO_DA_FACCAO']);
 
   function isPgTextArray(s) { s=(s||'').trim(); return s.length>=2 && s[0]=='{' && s[s.length-1]=='}'; }
   function cleanLabel(raw) {
@@ -520,32 +938,27 @@ async def vis_visjs(
     return map;
   }
 
+  // cor CV/PCC sugerida pelo rótulo (CV tem precedência); '' quando não há
+  function toneOf(label) {
+    const L = label.toUpperCase();
+    if (L.includes('CV'))  return COLOR_CV;
+    if (L.includes('PCC')) return COLOR_PCC;
+    return '';
+  }
+
   // regra de cor por nó (considera group/faccao_id; type; e o próprio label)
-  function colorForNode(n, faccaoColorById) {
-    const gid = String(n.group ?? n.faccao_id ?? '');
-    if (gid && faccaoColorById[gid]) return faccaoColorById[gid];
+  function colorForNode(group, type, label, faccaoColorById) {
+    if (group && faccaoColorById[group]) return faccaoColorById[group];
 
-    const t = String(n.type||'').toLowerCase();
-    const L = String(n.label||'').toUpperCase();
+    const t = String(type||'').toLowerCase();
 
     // variações "funcao/função"
     if (t.includes('funç') || t === 'funcao') return COLOR_FUN;
 
-    // variações "faccao/facção"
-    if (t.includes('facc')) {
-      if (L.includes('CV'))  return COLOR_CV;
-      if (L.includes('PCC')) return COLOR_PCC;
-    }
-
-    // fallback pelo rótulo do nó
-    if (L.includes('CV'))  return COLOR_CV;
-    if (L.includes('PCC')) return COLOR_PCC;
-
-    return COLOR_DEF;
+    // facções e demais nós: pelo rótulo
+    return toneOf(label) || COLOR_DEF;
   }
 
-  function edgeStyleFor(rel) { return { color: EDGE_COLORS[rel] || '#b0bec5', width: 0.1 }; } // ultrafina
-
   function degreeMap(nodes,edges) {
     const d={}; nodes.forEach(n=>d[n.id]=0);
     edges.forEach(e=>{ if(e.from in d) d[e.from]++; if(e.to in d) d[e.to]++; });
@@ -563,74 +976,99 @@ async def vis_visjs(
     };
   }
 
-  function render(data){
+  // payload cru (/v1/graph/membros) -> objetos do vis.DataSet; com
+  // source=server o servidor já entrega os campos prontos (data.prepared)
+  function prepare(data){
     const rawNodes = data.nodes || [];
     const rawEdges = data.edges || [];
 
     const faccaoColorById = inferFaccaoColors(rawNodes);
 
-    // índice label por id (para colorir arestas por CV/PCC)
-    const labelById = {};
-    rawNodes.forEach(n => { labelById[String(n.id)] = cleanLabel(n.label||''); });
-
-    // nós
+    // nós (e, na mesma passada, o tom CV/PCC do rótulo por id, para as arestas)
+    const toneById = {};
     const nodes = [];
     const seen = new Set();
     for (const n of rawNodes) {
       if(!n || n.id==null) continue;
       const id = String(n.id);
+      const clean = cleanLabel(n.label);
+      toneById[id] = toneOf(clean);
       if (seen.has(id)) continue; seen.add(id);
 
-      const label = cleanLabel(n.label) || id;
+      const label = clean || id;
       const group = String(n.group ?? n.faccao_id ?? n.type ?? '0');
       const photo = n.photo_url && /^https?:\\/\\//i.test(n.photo_url) ? n.photo_url : null;
 
-      const color = colorForNode({group, type:n.type, label}, faccaoColorById);
+      const color = colorForNode(group, n.type, label, faccaoColorById);
 
       const base = { id, label, group, color, borderWidth: 1 };
       if (photo) { base.shape='circularImage'; base.image=photo; } else { base.shape='dot'; }
       nodes.push(base);
     }
 
-    const nodeIds = new Set(nodes.map(n=>n.id));
-
     // arestas (com cor puxada pelo label dos nós CV/PCC)
     const edges = [];
     for (const e of (rawEdges||[])) {
       if(!e) continue;
       const a = String(e.source ?? e.from);
       const b = String(e.target ?? e.to);
-      if(!nodeIds.has(a) || !nodeIds.has(b)) continue;
+      if(!seen.has(a) || !seen.has(b)) continue;
 
       const rel = e.relation || '';
-      const style = edgeStyleFor(rel);
-
-      const la = String(labelById[a] || '').toUpperCase();
-      const lb = String(labelById[b] || '').toUpperCase();
-
-      let edgeColor = style.color;
-      if (la.includes('CV') || lb.includes('CV')) edgeColor = COLOR_CV;
-      else if (la.includes('PCC') || lb.includes('PCC')) edgeColor = COLOR_PCC;
+      let edgeColor;
       // funções continuam amarelas
-      if (rel === 'EXERCE' || rel === 'FUNCAO_DA_FACCAO') edgeColor = COLOR_FUN;
+      if (FUN_RELS.has(rel)) edgeColor = COLOR_FUN;
+      else {
+        const ta = toneById[a], tb = toneById[b];
+        if (ta === COLOR_CV || tb === COLOR_CV) edgeColor = COLOR_CV;
+        else if (ta === COLOR_PCC || tb === COLOR_PCC) edgeColor = COLOR_PCC;
+        else edgeColor = EDGE_COLORS[rel] || '#b0bec5';
+      }
 
       edges.push({ from:a, to:b, value: Number(e.weight||1), width: 0.1, color: edgeColor, title: rel });
     }
 
+    // explode nós com maior grau
+    const deg = degreeMap(nodes, edges);
+    nodes.forEach(n=>{ const d=deg[n.id]||0; n.value = 14 + Math.log(d+1)*10; });
+    return { nodes, edges };
+  }
+
+  // colunas do servidor (source=server) -> objetos; arestas apontam para o
+  // índice do nó em nodes.id
+  function fromColumns(data){
+    const cn = data.nodes, ce = data.edges;
+    const N = cn.id.length, M = ce.from.length;
+    const nodes = new Array(N), edges = new Array(M);
+    for (let k = 0; k < N; k++) {
+      const img = cn.image[k];
+      const n = { id: cn.id[k], label: cn.label[k], group: cn.group[k], color: cn.color[k], borderWidth: 1, shape: img ? 'circularImage' : 'dot', value: cn.value[k] };
+      if (img) n.image = img;
+      nodes[k] = n;
+    }
+    for (let k = 0; k < M; k++) {
+      edges[k] = { from: cn.id[ce.from[k]], to: cn.id[ce.to[k]], value: ce.value[k], width: 0.1, color: ce.color[k], title: ce.title[k] };
+    }
+    return { nodes, edges };
+  }
+
+  function render(data){
+    const ready = data.prepared ? fromColumns(data) : prepare(data);
+    const nodes = ready.nodes;
+    const edges = ready.edges;
+
     if (!nodes.length) {
       container.innerHTML='<div style="padding:12px">Sem dados.</div>';
       return;
     }
 
-    // explode nós com maior grau
-    const deg = degreeMap(nodes, edges);
-    nodes.forEach(n=>{ const d=deg[n.id]||0; n.value = 14 + Math.log(d+1)*10; });
-
     const dsNodes = new vis.DataSet(nodes);
     const dsEdges = new vis.DataSet(edges);
 
+    // grafos grandes: arestas ocultas durante arraste/zoom (mesmo corte do PyVis)
+    const big = nodes.length > 500;
     const options = {
-      interaction: { hover:true, dragNodes:true, dragView:true, zoomView:true, multiselect:true, navigationButtons:true },
+      interaction: { hover:true, dragNodes:true, dragView:true, zoomView:true, multiselect:true, navigationButtons:true, hideEdgesOnDrag: big, hideEdgesOnZoom: big },
       physics: { enabled: true, stabilization: { enabled:true, iterations: 300 } },
       nodes: { shape:'dot', borderWidth:2 },
       edges: { smooth:false, width:0.1, arrows: { to: { enabled: true, scaleFactor:0.5 } } }
@@ -643,18 +1081,19 @@ async def vis_visjs(
     // Busca/destaque
     const q = document.getElementById('kg-search');
     if (q) {
+      // índice de busca montado uma vez: rótulos já em minúsculas, sem copiar o
+      // DataSet a cada busca
+      const index = nodes.map(n => ({ id: n.id, sid: String(n.id), l: (n.label||'').toLowerCase() }));
       function run() {
         const t=(q.value||'').trim().toLowerCase(); if(!t) return;
-        const all=dsNodes.get();
-        const hits=all.filter(n => (n.label||'').toLowerCase().includes(t) || String(n.id)===t);
+        const hits=[];
+        for (const x of index) if (x.l.includes(t) || x.sid===t) hits.push(x.id);
         if(!hits.length) return;
-        all.forEach(n => dsNodes.update({ id: n.id, color: colorObj(n.color, 0.25) }));
-        hits.forEach(h => {
-          const cur=dsNodes.get(h.id);
-          dsNodes.update({ id: h.id, color: colorObj(cur.color, 1) });
-        });
+        // um único update em lote (um redesenho), não um por nó
+        const hitIds = new Set(hits);
+        dsNodes.update(dsNodes.get().map(n => ({ id: n.id, color: colorObj(n.color, hitIds.has(n.id) ? 1 : 0.25) })));
         net.setOptions({ physics: false });
-        net.fit({ nodes: hits.map(h=>h.id), animation: { duration: 300 } });
+        net.fit({ nodes: hits, animation: { duration: 300 } });
       }
       q.addEventListener('change', run);
       q.addEventListener('keyup', e=>{ if(e.key==='Enter') run(); });
@@ -688,241 +1127,428 @@ async def vis_visjs(
 </script>
 """
 
-    # ---- HTML montado por concatenação ----
-    parts: List[str] = []
-    parts.append("<!doctype html>\n")
-    parts.append('<html lang="pt-br">\n')
-    parts.append("  <head>\n")
-    parts.append('    <meta charset="utf-8" />\n')
-    parts.append(f"    <title>{title}</title>\n")
-    parts.append(f'    <link rel="stylesheet" href="{css_href}">\n')
-    parts.append('    <link rel="stylesheet" href="/static/vis-style.css">\n')
-    parts.append(f'    <meta name="theme-color" content="{bg}">\n')
-    parts.append("    <style>\n")
-    parts.append("      html,body,#mynetwork { height:100%; margin:0; }\n")
-    parts.append(
-        "      .kg-toolbar { display:flex; gap:8px; align-items:center; padding:8px; border-bottom:1px solid #e0e0e0; }\n"
-    )
-    parts.append(
-        '      .kg-toolbar input[type="search"] { flex: 1; min-width: 220px; padding:6px 10px; border-radius:1px; outline:none; }\n'
-    )
-    parts.append(
-        "      .kg-toolbar button { padding:6px 10px; border:1px solid #e0e0e0; background:transparent; border-radius:1px; cursor:pointer; }\n"
-    )
-    parts.append("      .kg-toolbar button:hover { background: rgba(0,0,0,.04); }\n")
-    parts.append("    </style>\n")
-    parts.append("  </head>\n")
-    parts.append(f'  <body data-theme="{theme}">\n')
-    parts.append('    <div class="kg-toolbar">\n')
-    parts.append(f'      <h4 style="margin:0">{title}</h4>\n')
-    parts.append(
-        '      <input id="kg-search" type="search" placeholder="Buscar no gráfico" />\n'
-    )
-    parts.append(
-        '      <button id="btn-print" type="button" title="Imprimir">Imprimir</button>\n'
-    )
-    parts.append(
-        '      <button id="btn-reload" type="button" title="Recarregar">Recarregar</button>\n'
-    )
-    parts.append("    </div>\n")
-    parts.append('    <div id="mynetwork" style="height:100%;width:100%;"\n')
-    parts.append('         data-endpoint="/v1/graph/membros"\n')
-    parts.append(f'         data-source="{source}"\n')
-    parts.append(f'         data-debug="{str(debug).lower()}"></div>\n')
-    parts.append(f"    {embedded_block}\n")
-    parts.append(f'    <script src="{js_href}"></script>\n')
-    parts.append(script_js)
-    parts.append("  </body>\n")
-    parts.append("</html>\n")
-    html = "".join(parts)
-
-    # CSP: permitir imagens http/https (para photo_url)
-    response.headers["Content-Security-Policy"] = (
+_VISJS_TEMPLATE = (
+    "<!doctype html>\n"
+    '<html lang="pt-br">\n'
+    "  <head>\n"
+    '    <meta charset="utf-8" />\n'
+    "    <title>%%TITLE%%</title>\n"
+    '    <link rel="stylesheet" href="' + _VIS_CSS_HREF + '">\n'
+    '    <link rel="stylesheet" href="/static/vis-style.css">\n'
+    '    <meta name="theme-color" content="%%BG%%">\n'
+    "    <style>\n"
+    "      html,body,#mynetwork { height:100%; margin:0; }\n"
+    "      .kg-toolbar { display:flex; gap:8px; align-items:center; padding:8px; border-bottom:1px solid #e0e0e0; }\n"
+    '      .kg-toolbar input[type="search"] { flex: 1; min-width: 220px; padding:6px 10px; border-radius:1px; outline:none; }\n'
+    "      .kg-toolbar button { padding:6px 10px; border:1px solid #e0e0e0; background:transparent; border-radius:1px; cursor:pointer; }\n"
+    "      .kg-toolbar button:hover { background: rgba(0,0,0,.04); }\n"
+    "    </style>\n"
+    "  </head>\n"
+    '  <body data-theme="%%THEME%%">\n'
+    '    <div class="kg-toolbar">\n'
+    '      <h4 style="margin:0">%%TITLE%%</h4>\n'
+    '      <input id="kg-search" type="search" placeholder="Buscar no gráfico" />\n'
+    '      <button id="btn-print" type="button" title="Imprimir">Imprimir</button>\n'
+    '      <button id="btn-reload" type="button" title="Recarregar">Recarregar</button>\n'
+    "    </div>\n"
+    '    <div id="mynetwork" style="height:100%;width:100%;"\n'
+    '         data-endpoint="/v1/graph/membros"\n'
+    '         data-source="%%SOURCE%%"\n'
+    '         data-debug="%%DEBUG%%"></div>\n'
+    "    %%EMBEDDED%%\n"
+    '    <script src="' + _VIS_JS_HREF + '"></script>\n' + _VISJS_SCRIPT + "  </body>\n"
+    "</html>\n"
+)
+
+# Trechos literais já em bytes (índices pares) intercalados com nomes de marcador.
+_VISJS_PARTS: List[Any] = [
+    p.encode("utf-8") if i % 2 == 0 else p
+    for i, p in enumerate(re.split(r"%%(\w+)%%", _VISJS_TEMPLATE))
+]
+
+# CSP: permitir imagens http/https (para photo_url)
+_VISJS_HEADERS = {
+    "Content-Security-Policy": (
         "default-src 'self'; "
         "style-src 'self' 'unsafe-inline' https://unpkg.com; "
         "script-src 'self' 'unsafe-inline' https://unpkg.com; "
         "img-src 'self' data: https: http:; "
         "connect-src 'self';"
+    ),
+    "X-Content-Type-Options": "nosniff",
+}
+
+
+_VISJS_EMBED_AT = _VISJS_PARTS.index("EMBEDDED")
+
+
+def _render_visjs(values: Dict[str, str], parts: List[Any]) -> bytes:
+    return b"".join(
+        p if isinstance(p, bytes) else values[p].encode("utf-8") for p in parts
     )
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    return HTMLResponse(html, status_code=200)
 
 
-# -----------------------------------------------------------------------------
-# PYVIS
-# -----------------------------------------------------------------------------
-from pyvis.network import Network  # noqa: E402
+@lru_cache(maxsize=64)
+def _visjs_shell(
+    title: str, theme: str, source: str, debug: bool
+) -> Tuple[bytes, bytes]:
+    # Fora o JSON embutido, a página só depende destes parâmetros: o que vem
+    # antes e depois do marcador EMBEDDED é montado uma vez por combinação.
+    values = {
+        "TITLE": title.translate(_HTML_ESCAPE),
+        "BG": "#0b0f19" if theme == "dark" else "#ffffff",
+        "THEME": theme,
+        "SOURCE": source,
+        "DEBUG": str(debug).lower(),
+    }
+    return (
+        _render_visjs(values, _VISJS_PARTS[:_VISJS_EMBED_AT]),
+        _render_visjs(values, _VISJS_PARTS[_VISJS_EMBED_AT + 1 :]),
+    )
 
 
-@app.get("/v1/vis/pyvis", response_class=HTMLResponse, tags=["viz"])
-async def vis_pyvis(
+# Mesma regra do cliente vis.js (/^https?:\/\//i), compilada uma vez.
+_PHOTO_URL_RE = re.compile(r"https?://", re.IGNORECASE)
+
+# Cores do cliente vis.js (mesmos valores das constantes COLOR_* do script).
+_VISJS_COLOR_CV = "#d32f2f"
+_VISJS_COLOR_PCC = "#0d47a1"
+_VISJS_COLOR_FUN = "#fdd835"
+_VISJS_COLOR_DEF = "#607d8b"
+_VISJS_EDGE_COLORS = {
+    "PERTENCE_A": "#9e9e9e",
+    "EXERCE": _VISJS_COLOR_FUN,
+    "FUNCAO_DA_FACCAO": _VISJS_COLOR_FUN,
+    "CO_FACCAO": "#aa9424",
+    "CO_FUNCAO": "#546e7a",
+}
+_VISJS_FUN_RELS = frozenset({"EXERCE", "FUNCAO_DA_FACCAO"})
+
+
+@lru_cache(maxsize=4096)
+def _visjs_tone(label: str) -> str:
+    # toneOf() do cliente: CV tem precedência sobre PCC; "" quando não há.
+    label = label.upper()
+    if "CV" in label:
+        return _VISJS_COLOR_CV
+    if "PCC" in label:
+        return _VISJS_COLOR_PCC
+    return ""
+
+
+def _prepare_visjs_data(data: Dict[str, Any]) -> Dict[str, Any]:
+    # Porta do render() do cliente (cleanLabel, cores, grau): com source=server o
+    # navegador recebe os campos prontos para o vis.DataSet e pula o laço O(N+E).
+    # A entrada vem de truncate_preview: nós únicos e arestas com pontas válidas.
+    # Saída em colunas (um array por campo, arestas por índice do nó): sem nomes
+    # de chave repetidos por item, o JSON embutido fica bem menor.
+    nodes = data.get("nodes", []) or []
+    edges = data.get("edges", []) or []
+
+    rows = []
+    index_by_id: Dict[str, int] = {}
+    tones: List[str] = []
+    faccao_color_by_id: Dict[str, str] = {}
+    for n in nodes:
+        nid = n["id"]
+        raw = n.get("label")
+        clean = _normalize_pg_text_array_label(str(raw).strip()) if raw else ""
+        tone = _visjs_tone(clean)
+        index_by_id[nid] = len(tones)
+        tones.append(tone)
+        ntype = str(n.get("type") or "").lower()
+        if tone and "facc" in ntype:
+            faccao_color_by_id[nid] = tone
+        rows.append((n, nid, clean or nid, ntype))
+
+    ids: List[str] = []
+    labels: List[str] = []
+    groups: List[str] = []
+    node_colors: List[str] = []
+    images: List[Optional[str]] = []
+    for n, nid, label, ntype in rows:
+        group = n.get("group")
+        if group is None:
+            group = n.get("faccao_id")
+        if group is None:
+            group = n.get("type")
+        group = "0" if group is None else str(group)
+
+        color = faccao_color_by_id.get(group)
+        if color is None:
+            if "funç" in ntype or ntype == "funcao":
+                color = _VISJS_COLOR_FUN
+            else:
+                color = _visjs_tone(label) or _VISJS_COLOR_DEF
+
+        photo = n.get("photo_url")
+        if not (isinstance(photo, str) and _PHOTO_URL_RE.match(photo)):
+            photo = None
+
+        ids.append(nid)
+        labels.append(label)
+        groups.append(group)
+        node_colors.append(color)
+        images.append(photo)
+
+    degree = [0] * len(ids)
+    sources: List[int] = []
+    targets: List[int] = []
+    weights: List[float] = []
+    edge_colors: List[str] = []
+    titles: List[str] = []
+    for e in edges:
+        a = index_by_id[e["source"]]
+        b = index_by_id[e["target"]]
+        rel = e.get("relation") or ""
+        if rel in _VISJS_FUN_RELS:
+            color = _VISJS_COLOR_FUN
+        else:
+            ta = tones[a]
+            tb = tones[b]
+            if ta == _VISJS_COLOR_CV or tb == _VISJS_COLOR_CV:
+                color = _VISJS_COLOR_CV
+            elif ta == _VISJS_COLOR_PCC or tb == _VISJS_COLOR_PCC:
+                color = _VISJS_COLOR_PCC
+            else:
+                color = _VISJS_EDGE_COLORS.get(rel, "#b0bec5")
+        try:
+            w = float(e.get("weight") or 1)
+        except Exception:
+            w = 1.0
+        degree[a] += 1
+        degree[b] += 1
+        sources.append(a)
+        targets.append(b)
+        weights.append(w)
+        edge_colors.append(color)
+        titles.append(rel)
+
+    # Nós de maior grau maiores (mesma escala do cliente).
+    return {
+        "prepared": True,
+        "nodes": {
+            "id": ids,
+            "label": labels,
+            "group": groups,
+            "color": node_colors,
+            "image": images,
+            "value": [14 + math.log(d + 1) * 10 for d in degree],
+        },
+        "edges": {
+            "from": sources,
+            "to": targets,
+            "value": weights,
+            "color": edge_colors,
+            "title": titles,
+        },
+    }
+
+
+def _visjs_data_block(data: Dict[str, Any], max_nodes: int, max_edges: int) -> bytes:
+    # Recorte + preparo + serialização (só CPU): roda numa thread do pool.
+    data = truncate_preview(data, max_nodes, max_edges)
+    body = orjson.dumps(_prepare_visjs_data(data))
+    # "</" dentro do JSON fecharia o <script>: "<\/" é o mesmo texto para o
+    # JSON.parse.
+    return (
+        b'<script id="__KG_DATA__" type="application/json">'
+        + body.replace(b"</", b"<\\/")
+        + b"</script>"
+    )
+
+
+@lru_cache(maxsize=64)
+def _visjs_client_page(title: str, theme: str, debug: bool) -> Tuple[bytes, bytes, str]:
+    head, tail = _visjs_shell(title, theme, "client", debug)
+    return _pack_body(head + tail)
+
+
+@app.get("/v1/vis/visjs", response_class=HTMLResponse, tags=["viz"])
+async def vis_visjs(
+    request: Request,
     faccao_id: Optional[int] = Query(default=None),
     include_co: bool = Query(default=True),
     max_pairs: int = Query(default=8000),
     max_nodes: int = Query(default=2000),
     max_edges: int = Query(default=4000),
     cache: bool = Query(default=True),
-    theme: str = Query(default="light"),
-    title: str = Query(default="Knowledge Graph (PyVis)"),
+    theme: str = Query(default="light", pattern="^(light|dark)$"),
+    title: str = Query(default="Knowledge Graph (vis.js)"),
+    debug: bool = Query(default=False),
+    source: str = Query(default="server", pattern="^(server|client)$"),
 ):
+    if source == "client":
+        # Sem dados embutidos a página é estática por (title, theme, debug):
+        # navegador/proxy guardam a casca e só o JSON passa pelo Python.
+        return _cached_body(
+            request,
+            _visjs_client_page(title, theme, debug),
+            _VISJS_HEADERS,
+            cache_control=_STATIC_CACHE_CONTROL,
+        )
+
+    page_key = (
+        faccao_id,
+        include_co,
+        max_pairs,
+        max_nodes,
+        max_edges,
+        theme,
+        title,
+        debug,
+    )
+    if cache:
+        hit = _cache_get(_visjs_cache, page_key)
+        if hit is not None:
+            return _cached_body(request, hit, _VISJS_HEADERS)
     try:
-        data = await fetch_graph_sanitized(
+        data, expires_at = await fetch_graph_sanitized(
             faccao_id, include_co, max_pairs, use_cache=cache
         )
-        data = truncate_preview(data, max_nodes, max_edges)
-        data = normalize_graph_labels(data)
+        embedded_block = await run_in_threadpool(
+            _visjs_data_block, data, max_nodes, max_edges
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"graph_fetch_error: {e}")
 
-    nodes = data.get("nodes", []) or []
-    edges = data.get("edges", []) or []
+    head, tail = _visjs_shell(title, theme, source, debug)
+    if not cache:
+        # Sem cache não há por que montar a página inteira: as partes seguem
+        # direto para o socket, como no PyVis com cache=false.
+        async def _chunks():
+            yield head
+            yield embedded_block
+            yield tail
+
+        return StreamingResponse(
+            _chunks(), status_code=200, media_type="text/html", headers=_VISJS_HEADERS
+        )
 
-    if not nodes:
-        return HTMLResponse("<h3>Sem dados para exibir.</h3>", status_code=200)
+    hit = await run_in_threadpool(_pack_body, b"".join((head, embedded_block, tail)))
+    _visjs_cache[page_key] = (hit, expires_at)
+    return _cached_body(request, hit, _VISJS_HEADERS)
 
-    faccao_name_by_id: Dict[str, str] = {}
-    for n in nodes:
-        if (n or {}).get("type") == "faccao" and n.get("id") is not None:
-            faccao_name_by_id[str(n["id"])] = str(n.get("label") or "").strip()
-
-    def color_from_faccao(fid: Optional[str]) -> Optional[str]:
-        if not fid:
-            return None
-        name = (faccao_name_by_id.get(fid) or "").upper()
-        if not name:
-            return None
-        if "PCC" in name:
-            return "#0d47a1"
-        if "CV" in name:
-            return "#d32f2f"
-        return None
 
-    def is_func(n: Dict[str, Any]) -> bool:
-        t = str(n.get("type") or "").lower()
-        return t == "funcao" or "função" in t or "funcao" in t
-
-    def hash_color(s: str) -> str:
-        h = 0
-        for ch in s:
-            h = (h << 5) - h + ord(ch)
-            h &= 0xFFFFFFFF
-        hue = abs(h) % 360
-        return f"hsl({hue},70%,50%)"
-
-    height = "90vh"
-    # height = "100%"
-    bgcolor = "#0b0f19" if theme == "dark" else "#ffffff"
-    fontcolor = "#e8eaed" if theme == "dark" else "#111827"
+# -----------------------------------------------------------------------------
+# PYVIS
+# -----------------------------------------------------------------------------
+import pyvis  # noqa: E402
+from jinja2 import Environment, FileSystemLoader  # noqa: E402
+
+# Template do PyVis (com os assets in_line de templates/lib) compilado uma única
+# vez; Network.generate_html recria o Environment e reparseia tudo a cada página.
+_PYVIS_TEMPLATE_DIR = os.path.join(os.path.dirname(pyvis.__file__), "templates")
+_PYVIS_ENV = Environment(loader=FileSystemLoader(_PYVIS_TEMPLATE_DIR))
+_PYVIS_TMPL = _PYVIS_ENV.get_template("template.html")
+
+# nodes/edges só passam pelo template via `|tojson`: o shell da página é
+# renderizado com marcadores no lugar deles e os dados entram como bytes.
+_PYVIS_NODES_SLOT = "@@KG_PYVIS_NODES@@"
+_PYVIS_EDGES_SLOT = "@@KG_PYVIS_EDGES@@"
+# Título da toolbar: texto livre da query, entra escapado só na montagem da
+# página (fora da chave do cache do shell).
+_PYVIS_TITLE_SLOT = "@@KG_PYVIS_TITLE@@"
+
+
+class _PyvisSlot:
+    # Substituto de nodes/edges no render do shell: `|length` responde ao teste
+    # "nodes|length > 100" do template e `|tojson` devolve o marcador.
+    def __init__(self, marker: str, size: int) -> None:
+        self.marker = marker
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+
+_PYVIS_ENV.policies["json.dumps_function"] = lambda obj, **kw: obj.marker
+
+# Tags de tipo emitidas pelo RPC (db/00_init.sql): teste O(1) por nó em vez de
+# varrer substrings do tipo.
+_FACCAO_TYPES = frozenset({"faccao", "facção"})
+_FUNC_TYPES = frozenset({"funcao", "função"})
+# Facções e funções nunca têm foto: nem se consulta photo_url nesses nós.
+_NO_PHOTO_TYPES = _FACCAO_TYPES | _FUNC_TYPES
+
+# HTML final do PyVis (bytes crus, gzip e ETag) por combinação de parâmetros
+# (expira junto com o grafo de origem, para não servir página mais velha que
+# os dados).
+_pyvis_cache: TLRUCache = TLRUCache(maxsize=CACHE_MAX_PAGES, ttu=_entry_deadline)
+
+# Opções do vis-network e toolbar estáticas: montadas (e as opções serializadas em
+# JSON) uma vez na importação.
+_PYVIS_OPTIONS: Dict[str, Any] = {
+    "interaction": {
+        "hover": True,
+        "dragNodes": True,
+        "dragView": True,
+        "zoomView": True,
+        "multiselect": True,
+        "navigationButtons": True,
+    },
+    "physics": {
+        "enabled": True,
+        "stabilization": {"enabled": True, "iterations": 300},
+    },
+    "nodes": {"shape": "dot", "borderWidth": 2},
+    "edges": {
+        "smooth": False,
+        "width": 0.1,
+        "arrows": {"to": {"enabled": True, "scaleFactor": 0.5}},
+    },
+}
 
-    net = Network(
-        height=height,
-        width="100%",
-        bgcolor=bgcolor,
-        font_color=fontcolor,
-        directed=True,
-        cdn_resources="in_line",
-    )
 
-    seen = set()
-    for n in nodes:
-        if not n or n.get("id") is None:
-            continue
-        nid = str(n["id"])
-        if nid in seen:
-            continue
-        seen.add(nid)
+def _pyvis_large_options(iterations: int) -> Dict[str, Any]:
+    # Grafos grandes: sem o improvedLayout (Kamada-Kawai inicial, caro no browser)
+    # e com menos iterações de estabilização; a toolbar desliga a física depois.
+    # Arestas ocultas durante arraste/zoom: cada quadro redesenha só os nós.
+    return {
+        **_PYVIS_OPTIONS,
+        "interaction": {
+            **_PYVIS_OPTIONS["interaction"],
+            "hideEdgesOnDrag": True,
+            "hideEdgesOnZoom": True,
+        },
+        "layout": {"improvedLayout": False},
+        "physics": {
+            "enabled": True,
+            "stabilization": {"enabled": True, "iterations": iterations},
+        },
+    }
 
-        label = str(n.get("label") or nid)
-        group = str(n.get("group") or n.get("faccao_id") or n.get("type") or "0")
-        size = n.get("size")
-        photo = (
-            n.get("photo_url")
-            if isinstance(n.get("photo_url"), str)
-            and n["photo_url"].startswith(("http://", "https://"))
-            else None
-        )
 
-        fixed_color = color_from_faccao(group)
-        color = fixed_color or ("#fdd835" if is_func(n) else hash_color(group))
+_PYVIS_OPTIONS_JSON = json.dumps(_PYVIS_OPTIONS)
+_PYVIS_OPTIONS_LARGE_JSON = json.dumps(_pyvis_large_options(150))
+_PYVIS_OPTIONS_HUGE_JSON = json.dumps(_pyvis_large_options(50))
 
-        node_kwargs: Dict[str, Any] = dict(title=label, color=color, borderWidth=2)
-        if isinstance(size, (int, float)):
-            node_kwargs["value"] = float(size)
-        if photo:
-            node_kwargs["shape"] = "circularImage"
-            node_kwargs["image"] = photo
-        else:
-            node_kwargs["shape"] = "dot"
-
-        net.add_node(nid, label=label, **node_kwargs)
-
-    valid_nodes = set(net.get_nodes())
-    EDGE_COLORS = {
-        "PERTENCE_A": "#9e9e9e",
-        "EXERCE": "#fdd835",
-        "FUNCAO_DA_FACCAO": "#fdd835",
-        # "CO_FACCAO": "#8e24aa",
-        "CO_FACCAO": "#d32f2f",
-        "CO_FUNCAO": "#546e7a",
-    }
 
-    for e in edges:
-        if not e:
-            continue
-        a = str(e.get("source"))
-        b = str(e.get("target"))
-        if a not in valid_nodes or b not in valid_nodes:
-            continue
-        rel = e.get("relation") or ""
-        try:
-            w = float(e.get("weight") or 1.0)
-        except Exception:
-            w = 1.0
-        color = EDGE_COLORS.get(rel, "#b0bec5")
-        net.add_edge(a, b, value=w, width=0.1, color=color, title=rel)
-
-    net.set_options(
-        """
-{
-  "interaction": {
-    "hover": true,
-    "dragNodes": true,
-    "dragView": true,
-    "zoomView": true,
-    "multiselect": true,
-    "navigationButtons": true
-  },
-  "physics": {
-    "enabled": true,
-    "stabilization": { "enabled": true, "iterations": 300 }
-  },
-  "nodes": { "shape": "dot", "borderWidth": 2 },
-  "edges": { "smooth": false, "width": 0.1, "arrows": { "to": { "enabled": true, "scaleFactor": 0.5 } } }
-}
-        """
-    )
+def _pyvis_options_json(n_nodes: int) -> str:
+    if n_nodes <= 500:
+        return _PYVIS_OPTIONS_JSON
+    if n_nodes <= 2000:
+        return _PYVIS_OPTIONS_LARGE_JSON
+    return _PYVIS_OPTIONS_HUGE_JSON
+
 
-    html = net.generate_html()
+_PYVIS_EDGE_COLORS = {
+    "PERTENCE_A": "#9e9e9e",
+    "EXERCE": "#fdd835",
+    "FUNCAO_DA_FACCAO": "#fdd835",
+    # "CO_FACCAO": "#8e24aa",
+    "CO_FACCAO": "#d32f2f",
+    "CO_FUNCAO": "#546e7a",
+}
 
-    # Toolbar minimalista
-    toolbar_css = """
-<style>
+_PYVIS_TOOLBAR_CSS = """
   .kg-toolbar { display:flex; gap:8px; align-items:center; padding:8px; border-bottom:1px solid #e0e0e0; }
   .kg-toolbar input[type="search"] { flex: 1; min-width:220px; padding:6px 10px; border:1px solid #e0e0e0; border-radius:1px; outline:none; }
   .kg-toolbar button { padding:6px 10px; border:1px solid #e0e0e0; background:transparent; border-radius:1px; cursor:pointer; }
   .kg-toolbar button:hover { background: rgba(0,0,0,.04); }
-</style>
-"""
-    toolbar_html = f"""
-<div class="kg-toolbar">
-  <h4 style="margin:0">{title}</h4>
-  <input id="kg-search" type="search" placeholder="Buscar no gráfico" />
-  <button id="btn-print" type="button" title="Imprimir">Imprimir</button>
-  <button id="btn-reload" type="button" title="Recarregar">Recarregar</button>
-</div>
 """
-    toolbar_js = """
-<script>
+
+_PYVIS_TOOLBAR_JS = """
 (function(){
   function colorObj(c, opacity){
     if (typeof c === 'object' && c) { return Object.assign({}, c, { opacity: opacity }); }
@@ -934,20 +1560,27 @@ async def vis_pyvis(
       opacity: opacity
     };
   }
+  // índice de busca (rótulos em minúsculas), montado na primeira busca
+  var index = null;
   function runSearch(txt){
     try{
       var ds = (typeof nodes !== 'undefined') ? nodes : (network && network.body && network.body.data && network.body.data.nodes);
       if (!ds) return;
-      var all = ds.get();
       var t = (txt||'').trim().toLowerCase();
       if (!t){ return; }
-      var hits = all.filter(function(n){ return (String(n.label||'').toLowerCase().indexOf(t) >= 0) || (String(n.id)===t); });
+      if (!index){
+        index = ds.get().map(function(n){ return { id: n.id, sid: String(n.id), l: String(n.label||'').toLowerCase() }; });
+      }
+      var hits = [];
+      var hitIds = {};
+      index.forEach(function(x){ if (x.l.indexOf(t) >= 0 || x.sid === t){ hits.push(x.id); hitIds[x.id] = true; } });
       if (!hits.length) return;
 
-      all.forEach(function(n){ ds.update({ id: n.id, color: colorObj(n.color, 0.25) }); });
-      hits.forEach(function(h){ var cur = ds.get(h.id); ds.update({ id: h.id, color: colorObj(cur.color, 1) }); });
+      var all = ds.get();
+      // um único update em lote (um redesenho), não um por nó
+      ds.update(all.map(function(n){ return { id: n.id, color: colorObj(n.color, hitIds[n.id] ? 1 : 0.25) }; }));
       network.setOptions({ physics: false });
-      network.fit({ nodes: hits.map(function(h){return h.id;}), animation: { duration: 300 } });
+      network.fit({ nodes: hits, animation: { duration: 300 } });
     }catch(e){ console.error(e); }
   }
   var q = document.getElementById('kg-search');
@@ -963,28 +1596,287 @@ async def vis_pyvis(
     network.once('stabilizationIterationsDone', function(){ network.setOptions({ physics: false }); });
   }
 })();
-</script>
 """
-    html = html.replace("</head>", toolbar_css + "\n</head>")
-    html = html.replace("<body>", "<body>\n" + toolbar_html + "\n")
-    html = html.replace("</body>", toolbar_js + "\n</body>")
-    return HTMLResponse(html, status_code=200)
+
+# Minificação na importação, quando rcssmin/rjsmin estão instalados: menos bytes
+# em toda resposta do PyVis sem custo por requisição.
+if rcssmin is not None and rjsmin is not None:
+    _PYVIS_TOOLBAR_CSS = "\n" + rcssmin.cssmin(_PYVIS_TOOLBAR_CSS) + "\n"
+    _PYVIS_TOOLBAR_JS = "\n" + rjsmin.jsmin(_PYVIS_TOOLBAR_JS) + "\n"
+_PYVIS_TOOLBAR_CSS = "\n<style>" + _PYVIS_TOOLBAR_CSS + "</style>\n"
+_PYVIS_TOOLBAR_JS = "\n<script>" + _PYVIS_TOOLBAR_JS + "</script>\n"
+
+
+@lru_cache(maxsize=1024)
+def _faccao_color(name: str) -> Optional[str]:
+    # Poucas facções distintas entre requisições: upper()/buscas só no 1º uso.
+    name = name.upper()
+    if "PCC" in name:
+        return "#0d47a1"
+    if "CV" in name:
+        return "#d32f2f"
+    return None
+
+
+# Só há 360 matizes possíveis: as strings de cor ficam prontas desde o import.
+_HSL_COLORS = tuple(f"hsl({h},70%,50%)" for h in range(360))
+
+
+@lru_cache(maxsize=4096)
+def _hash_color(s: str) -> str:
+    # crc32 (C) no lugar do laço por caractere; os grupos se repetem muito entre
+    # os nós, então a maioria das chamadas cai no cache.
+    return _HSL_COLORS[zlib.crc32(s.encode()) % 360]
+
+
+def _pyvis_json(items: List[Dict[str, Any]]) -> bytes:
+    # Mesmo escape do `|tojson` do Jinja (htmlsafe_json_dumps): o JSON vai
+    # dentro de <script>, então "<", ">", "&" e "'" viram \u00XX.
+    return (
+        orjson.dumps(items)
+        .replace(b"<", b"\\u003c")
+        .replace(b">", b"\\u003e")
+        .replace(b"&", b"\\u0026")
+        .replace(b"'", b"\\u0027")
+    )
+
+
+@lru_cache(maxsize=32)
+def _pyvis_shell(
+    theme: str, options: str, tooltip_link: bool, many_nodes: bool
+) -> Tuple[bytes, bytes, bytes, bytes]:
+    # Render do template + toolbar uma vez por combinação de tema/opções (no
+    # máximo 2 x 3 x 2 x 2); por página só se juntam o título e os bytes de nós
+    # e arestas entre os pedaços.
+    # Mesmos parâmetros que Network.generate_html passaria ao template
+    # (directed, cdn_resources="in_line", sem menus/DOT/configure).
+    html = _PYVIS_TMPL.render(
+        height="90vh",
+        width="100%",
+        nodes=_PyvisSlot(_PYVIS_NODES_SLOT, 101 if many_nodes else 0),
+        edges=_PyvisSlot(_PYVIS_EDGES_SLOT, 0),
+        heading="",
+        options=options,
+        physics_enabled=True,
+        use_DOT=False,
+        dot_lang="",
+        widget=False,
+        bgcolor="#0b0f19" if theme == "dark" else "#ffffff",
+        conf=False,
+        tooltip_link=tooltip_link,
+        neighborhood_highlight=False,
+        select_menu=False,
+        filter_menu=False,
+        notebook=False,
+        cdn_resources="in_line",
+    )
+
+    # Toolbar minimalista (CSS/JS estáticos em _PYVIS_TOOLBAR_*)
+    toolbar_html = f"""
+<div class="kg-toolbar">
+  <h4 style="margin:0">{_PYVIS_TITLE_SLOT}</h4>
+  <input id="kg-search" type="search" placeholder="Buscar no gráfico" />
+  <button id="btn-print" type="button" title="Imprimir">Imprimir</button>
+  <button id="btn-reload" type="button" title="Recarregar">Recarregar</button>
+</div>
+"""
+    head, _, rest = html.partition("</head>")
+    before_body, _, after_body_open = rest.partition("<body>")
+    body_mid, _, body_tail = after_body_open.rpartition("</body>")
+    page = "".join(
+        (
+            head,
+            _PYVIS_TOOLBAR_CSS,
+            "\n</head>",
+            before_body,
+            "<body>\n",
+            toolbar_html,
+            "\n",
+            body_mid,
+            _PYVIS_TOOLBAR_JS,
+            "\n</body>",
+            body_tail,
+        )
+    )
+    # O título fica na toolbar, antes do <script> com nós/arestas.
+    pre, _, rest = page.partition(_PYVIS_TITLE_SLOT)
+    head, _, rest = rest.partition(_PYVIS_NODES_SLOT)
+    mid, _, tail = rest.partition(_PYVIS_EDGES_SLOT)
+    return (
+        pre.encode("utf-8"),
+        head.encode("utf-8"),
+        mid.encode("utf-8"),
+        tail.encode("utf-8"),
+    )
+
+
+def _build_pyvis_page(
+    nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]], theme: str, title: str
+) -> Tuple[bytes, ...]:
+    # Só CPU (cores, dicts de nó/aresta, JSON dos dados): roda numa thread do
+    # pool para não travar o event loop enquanto monta páginas grandes.
+    faccao_name_by_id: Dict[str, str] = {
+        n["id"]: str(n.get("label") or "").strip()
+        for n in nodes
+        if n.get("type") in _FACCAO_TYPES
+    }
+
+    # Cor fixa por facção calculada uma vez por facção (não por nó).
+    group_color: Dict[str, str] = {}
+    for fid, name in faccao_name_by_id.items():
+        color = _faccao_color(name)
+        if color:
+            group_color[fid] = color
+
+    fontcolor = "#e8eaed" if theme == "dark" else "#111827"
+
+    font = {"color": fontcolor}
+    node_dicts: List[Dict[str, Any]] = []
+    # fetch_graph_sanitized/truncate_preview já entregam nós únicos, não nulos e
+    # com id str, e arestas cujas pontas existem no recorte.
+    for n in nodes:
+        nid = n["id"]
+        label = str(n.get("label") or nid)
+        group = str(n.get("group") or n.get("faccao_id") or n.get("type") or "0")
+        size = n.get("size")
+        ntype = str(n.get("type") or "").lower()
+        photo = None
+        if ntype not in _NO_PHOTO_TYPES:
+            p = n.get("photo_url")
+            if isinstance(p, str) and _PHOTO_URL_RE.match(p):
+                photo = p
+
+        color = group_color.get(group) or (
+            "#fdd835" if ntype in _FUNC_TYPES else _hash_color(group)
+        )
+
+        # Mesmas chaves que o Node do PyVis geraria, num único literal (sem o
+        # teste de duplicidade O(N) de add_node); value/image só quando existem.
+        node: Dict[str, Any] = {
+            "color": color,
+            "title": label,
+            "borderWidth": 2,
+            "id": nid,
+            "label": label,
+            "shape": "circularImage" if photo else "dot",
+            "font": font,
+        }
+        if isinstance(size, (int, float)):
+            node["value"] = float(size)
+        if photo:
+            node["image"] = photo
+        node_dicts.append(node)
+
+    edge_dicts: List[Dict[str, Any]] = []
+    add_edge = edge_dicts.append
+    edge_color = _PYVIS_EDGE_COLORS.get
+    for e in edges:
+        a = e["source"]
+        b = e["target"]
+        rel = e.get("relation") or ""
+        try:
+            w = float(e.get("weight") or 1.0)
+        except Exception:
+            w = 1.0
+        color = edge_color(rel, "#b0bec5")
+        # Equivalente ao Edge do PyVis (directed=True), sem o assert O(N) de
+        # add_edge: as pontas já foram validadas em truncate_preview.
+        add_edge(
+            {
+                "value": w,
+                "width": 0.1,
+                "color": color,
+                "title": rel,
+                "from": a,
+                "to": b,
+                "arrows": "to",
+            }
+        )
+
+    # Só o título e o JSON dos dados são gerados por página; o resto vem do
+    # shell em cache.
+    pre, head, mid, tail = _pyvis_shell(
+        theme,
+        _pyvis_options_json(len(node_dicts)),
+        any("href" in n["title"] for n in node_dicts),
+        len(node_dicts) > 100,
+    )
+    return (
+        pre,
+        title.translate(_HTML_ESCAPE).encode("utf-8"),
+        head,
+        _pyvis_json(node_dicts),
+        mid,
+        _pyvis_json(edge_dicts),
+        tail,
+    )
+
+
+def _pack_pyvis_page(
+    nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]], theme: str, title: str
+) -> Tuple[bytes, bytes, str]:
+    return _pack_body(b"".join(_build_pyvis_page(nodes, edges, theme, title)))
+
+
+@app.get("/v1/vis/pyvis", response_class=HTMLResponse, tags=["viz"])
+async def vis_pyvis(
+    request: Request,
+    faccao_id: Optional[int] = Query(default=None),
+    include_co: bool = Query(default=True),
+    max_pairs: int = Query(default=8000),
+    max_nodes: int = Query(default=2000),
+    max_edges: int = Query(default=4000),
+    cache: bool = Query(default=True),
+    theme: str = Query(default="light", pattern="^(light|dark)$"),
+    title: str = Query(default="Knowledge Graph (PyVis)"),
+):
+    page_key = (faccao_id, include_co, max_pairs, max_nodes, max_edges, theme, title)
+    if cache:
+        hit = _cache_get(_pyvis_cache, page_key)
+        if hit is not None:
+            return _cached_body(request, hit)
+
+    try:
+        data, expires_at = await fetch_graph_sanitized(
+            faccao_id, include_co, max_pairs, use_cache=cache
+        )
+        data = truncate_preview(data, max_nodes, max_edges)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"graph_fetch_error: {e}")
+
+    nodes = data.get("nodes", []) or []
+    edges = data.get("edges", []) or []
+
+    if not nodes:
+        return HTMLResponse("<h3>Sem dados para exibir.</h3>", status_code=200)
+
+    if cache:
+        hit = await run_in_threadpool(_pack_pyvis_page, nodes, edges, theme, title)
+        _pyvis_cache[page_key] = (hit, expires_at)
+        return _cached_body(request, hit)
+
+    parts = await run_in_threadpool(_build_pyvis_page, nodes, edges, theme, title)
+
+    async def _chunks():
+        for part in parts:
+            yield part
+
+    return StreamingResponse(_chunks(), status_code=200, media_type="text/html")
 
 
 # -----------------------------------------------------------------------------
 # /docs (Swagger UI custom)
 # -----------------------------------------------------------------------------
-@app.get("/docs", response_class=HTMLResponse, include_in_schema=False)
-async def custom_docs():
-    # CSP: permitir imagens de CDNs e http/https
-    csp = (
-        "default-src 'self'; "
-        "img-src 'self' data: https://cdn.jsdelivr.net https: http:; "
-        "style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net; "
-        "script-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net; "
-        "connect-src 'self';"
-    )
-    html = """
+# CSP: permitir imagens de CDNs e http/https
+_DOCS_CSP = (
+    "default-src 'self'; "
+    "img-src 'self' data: https://cdn.jsdelivr.net https: http:; "
+    "style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net; "
+    "script-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net; "
+    "connect-src 'self';"
+)
+
+_DOCS_HTML = """
 <!doctype html>
 <html lang="pt-br">
   <head>
@@ -1069,7 +1961,26 @@ async def custom_docs():
   </body>
 </html>
 """
-    resp = HTMLResponse(html, status_code=200)
-    resp.headers["Content-Security-Policy"] = csp
-    resp.headers["X-Content-Type-Options"] = "nosniff"
-    return resp
+
+# Página 100% estática: bytes e cabeçalhos prontos desde a importação.
+_DOCS_BYTES = _DOCS_HTML.encode("utf-8")
+_DOCS_GZ = gzip.compress(_DOCS_BYTES, compresslevel=6)
+# ETag fraca: as variantes crua e gzip são equivalentes em conteúdo.
+_DOCS_ETAG = _weak_etag(_DOCS_BYTES)
+_DOCS_CACHE_HEADERS = {
+    "ETag": _DOCS_ETAG,
+    "Cache-Control": "public, max-age=300",
+    "Vary": "Accept-Encoding",
+}
+_DOCS_HEADERS = {
+    "Content-Security-Policy": _DOCS_CSP,
+    "X-Content-Type-Options": "nosniff",
+    **_DOCS_CACHE_HEADERS,
+}
+
+
+@app.get("/docs", response_class=HTMLResponse, include_in_schema=False)
+async def custom_docs(request: Request):
+    if _etag_matches(request, _DOCS_ETAG):
+        return Response(status_code=304, headers=_DOCS_CACHE_HEADERS)
+    return _precompressed(request, _DOCS_BYTES, _DOCS_GZ, _DOCS_HEADERS)